@@ -6,11 +6,24 @@ Based on PaddleOCR 3.x documentation
 
 import os
 import sys
-import subprocess
+import shutil
+import hashlib
+import importlib.metadata
 import argparse
+import contextlib
+import tempfile
 import json
+import tarfile
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 
+try:
+    from onnxruntime.quantization import CalibrationDataReader
+except ImportError:
+    CalibrationDataReader = object
+
 # Model URLs for PP-OCRv5
 MODEL_URLS = {
     "det": {
@@ -26,123 +39,536 @@ MODEL_URLS = {
 
 # ONNX optimization settings for web deployment
 ONNX_SETTINGS = {
-    "opset_version": 11,  # Higher opset for better operator support
-    "enable_onnx_checker": True,
+    "opset_version": 17,  # Enables fused LayerNorm and per-channel QLinearConv
+    "fallback_opset_version": 16,  # Retried if an op fails to export at opset 17
+    "enable_onnx_checker": False,  # Opt-in via --strict-check, ORT re-validates on load
     "enable_auto_update_opset": True,
     "deploy_backend": "onnxruntime",  # Optimize for ONNX Runtime
     "save_external_data": False,  # Keep model in single file
     "enable_optimize": True,  # Enable graph optimizations
 }
 
-def download_model(url, output_dir):
+# Model input shapes (NCHW), -1 marks a dynamic axis
+INPUT_SHAPES = {
+    "det": [-1, 3, -1, -1],
+    "rec": [-1, 3, 48, -1],
+}
+DYNAMIC_AXIS_NAMES = {0: "batch", 2: "height", 3: "width"}
+
+# Fixed rec widths let ORT plan memory and fold reshapes once per session
+REC_WIDTH_BUCKETS = [160, 320, 480]
+
+# Static quantization calibration settings (mirror the client preprocessing)
+CALIBRATION_SETTINGS = {
+    "max_images": 50,
+    "det_limit_side_len": 960,
+    "det_mean": [0.485, 0.456, 0.406],
+    "det_std": [0.229, 0.224, 0.225],
+    "rec_image_shape": [3, 48, 320],
+}
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# Switch to external weight files well before the 2GB protobuf limit
+EXTERNAL_DATA_THRESHOLD = 1_800_000_000
+
+def check_calibration_dependencies():
+    """Fail early if the packages the calibration reader needs are missing"""
+    missing = []
+    for module_name, package in (("numpy", "numpy"), ("PIL", "pillow")):
+        try:
+            __import__(module_name)
+        except ImportError:
+            missing.append(package)
+    if missing:
+        raise RuntimeError(
+            f"--calibration-dir needs {', '.join(missing)}. Install with: pip install {' '.join(missing)}"
+        )
+
+class PaddleOCRCalibrationDataReader(CalibrationDataReader):
+    """Feed representative images to ONNX Runtime static quantization"""
+    
+    def __init__(self, image_dir, input_name, model_type="det", rec_width=None):
+        self.image_paths = sorted(
+            p for p in Path(image_dir).iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS
+        )[:CALIBRATION_SETTINGS["max_images"]]
+        if not self.image_paths:
+            raise ValueError(f"No calibration images found in {image_dir}")
+        self.input_name = input_name
+        self.model_type = model_type
+        self.rec_width = rec_width or CALIBRATION_SETTINGS["rec_image_shape"][2]
+        self.rewind()
+    
+    def _preprocess(self, image_path):
+        import numpy as np
+        from PIL import Image
+        
+        # PIL decodes to RGB; channels are flipped to BGR below, as the client
+        # (COLOR_RGBA2BGR) and PP-OCR training both feed BGR
+        image = Image.open(image_path).convert('RGB')
+        width, height = image.size
+        
+        if self.model_type == "det":
+            # Limit the longest side and snap to multiples of 32 like DetResizeForTest
+            limit = CALIBRATION_SETTINGS["det_limit_side_len"]
+            ratio = min(1.0, limit / max(width, height))
+            resize_w = max(32, int(round(width * ratio / 32)) * 32)
+            resize_h = max(32, int(round(height * ratio / 32)) * 32)
+            data = np.asarray(image.resize((resize_w, resize_h)), dtype=np.float32)[..., ::-1] / 255.0
+            data = (data - np.array(CALIBRATION_SETTINGS["det_mean"], dtype=np.float32)) / \
+                np.array(CALIBRATION_SETTINGS["det_std"], dtype=np.float32)
+        else:
+            # Keep aspect ratio at height 48 and right-pad to the client width
+            rec_h, rec_w = CALIBRATION_SETTINGS["rec_image_shape"][1], self.rec_width
+            resize_w = min(rec_w, max(1, int(np.ceil(rec_h * width / height))))
+            resized = np.asarray(image.resize((resize_w, rec_h)), dtype=np.float32)[..., ::-1] / 255.0
+            data = np.zeros((rec_h, rec_w, 3), dtype=np.float32)
+            data[:, :resize_w, :] = (resized - 0.5) / 0.5
+        
+        return data.transpose(2, 0, 1)[np.newaxis].astype(np.float32)
+    
+    def get_next(self):
+        image_path = next(self._iterator, None)
+        if image_path is None:
+            return None
+        return {self.input_name: self._preprocess(image_path)}
+    
+    def rewind(self):
+        self._iterator = iter(self.image_paths)
+
+HASH_CHUNK_SIZE = 1 << 20
+
+# Seconds without data before a stalled download is abandoned
+DOWNLOAD_TIMEOUT = 60
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join("~", ".cache")), "client-ocr-app", "paddle-models"
+)
+
+def download_model(url, output_dir, skip_download=False):
     """Download and extract PaddleOCR model"""
     filename = url.split('/')[-1]
-    filepath = os.path.join(output_dir, filename)
+    extract_dir = os.path.join(output_dir, filename.replace('.tar', ''))
+    hash_path = extract_dir + '.sha256'
     
-    if not os.path.exists(filepath):
-        print(f"Downloading {filename}...")
-        subprocess.run(["wget", "-q", url, "-O", filepath], check=True)
+    if skip_download and os.path.exists(extract_dir):
+        print(f"Skipping download, using existing {extract_dir}")
+        return extract_dir
     
-    # Extract tar file
-    extract_dir = filepath.replace('.tar', '')
-    if not os.path.exists(extract_dir):
-        print(f"Extracting {filename}...")
-        subprocess.run(["tar", "-xf", filepath, "-C", output_dir], check=True)
+    # The archive is never stored, so verify the cache against the SHA256
+    # of the extracted model files recorded after the last complete extraction
+    if os.path.exists(hash_path) and os.path.exists(extract_dir):
+        with open(hash_path) as f:
+            recorded_hash = f.read().strip()
+        try:
+            cached = recorded_hash == paddle_model_hash(extract_dir)
+        except OSError:
+            cached = False
+        if cached:
+            print(f"Using cached {filename}")
+            return extract_dir
+        print(f"Cached {filename} does not match its recorded SHA256, downloading again")
+    
+    # Stream the tar straight from the response into the output directory
+    print(f"Downloading and extracting {filename}...")
+    with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as response:
+        with tarfile.open(fileobj=response, mode='r|') as tf:
+            if hasattr(tarfile, 'data_filter'):
+                tf.extractall(output_dir, filter='data')
+            else:
+                tf.extractall(output_dir)
+    
+    with open(hash_path, 'w') as f:
+        f.write(paddle_model_hash(extract_dir))
     
     return extract_dir
 
+def set_input_shape(onnx_path, shape):
+    """Rewrite the model input dims, -1 marks a named dynamic axis"""
+    import onnx
+    
+    model = onnx.load(onnx_path)
+    initializer_names = {init.name for init in model.graph.initializer}
+    model_input = next(i for i in model.graph.input if i.name not in initializer_names)
+    
+    dims = model_input.type.tensor_type.shape.dim
+    del dims[:]
+    for axis, size in enumerate(shape):
+        dim = dims.add()
+        if size == -1:
+            dim.dim_param = DYNAMIC_AXIS_NAMES.get(axis, f"dim_{axis}")
+        else:
+            dim.dim_value = size
+    
+    onnx.save(model, onnx_path)
+
+def restore_dynamic_axes(source_path, target_path):
+    """Re-mark input axes that were dynamic in the source but got fixed in the target"""
+    import onnx
+    
+    source_dims = {
+        i.name: list(i.type.tensor_type.shape.dim)
+        for i in onnx.load(source_path, load_external_data=False).graph.input
+    }
+    # Leave external weights untouched, only the graph inputs are rewritten
+    model = onnx.load(target_path, load_external_data=False)
+    
+    restored = False
+    for model_input in model.graph.input:
+        for axis, (source_dim, dim) in enumerate(
+            zip(source_dims.get(model_input.name, []), model_input.type.tensor_type.shape.dim)
+        ):
+            if source_dim.HasField('dim_value') or not dim.HasField('dim_value'):
+                continue
+            dim.dim_param = source_dim.dim_param or DYNAMIC_AXIS_NAMES.get(axis, f"dim_{axis}")
+            restored = True
+    
+    if restored:
+        print(f"Restored dynamic input axes in {target_path}")
+        onnx.save(model, target_path)
+
+def paddle_model_hash(paddle_model_dir):
+    """Hash the Paddle program and weights that determine the exported ONNX"""
+    sha256 = hashlib.sha256()
+    for filename in ("inference.pdmodel", "inference.pdiparams"):
+        with open(os.path.join(paddle_model_dir, filename), 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                sha256.update(chunk)
+    return sha256.hexdigest()
+
+def width_bucket_path(onnx_path, width):
+    """Path of the fixed-width variant of a rec model"""
+    return onnx_path.replace('.onnx', f'_w{width}.onnx')
+
+def export_width_buckets(onnx_path, overwrite=True):
+    """Write fixed-width [1, 3, 48, W] copies of a rec model for clients that bucket crops"""
+    for width in REC_WIDTH_BUCKETS:
+        bucket_path = width_bucket_path(onnx_path, width)
+        if overwrite or not os.path.exists(bucket_path):
+            shutil.copy2(onnx_path, bucket_path)
+            set_input_shape(bucket_path, [1, 3, 48, width])
+            print(f"Fixed-width version: {bucket_path}")
+
 def convert_to_onnx(paddle_model_dir, onnx_output_path, model_type="det"):
     """Convert Paddle model to optimized ONNX format"""
-    print(f"Converting {model_type} model to ONNX...")
+    # Skip conversion if the previous export came from identical Paddle files,
+    # conversion settings, input shape and paddle2onnx release (so an opset
+    # fallback is retried after upgrading paddle2onnx)
+    try:
+        paddle2onnx_version = importlib.metadata.version("paddle2onnx")
+    except importlib.metadata.PackageNotFoundError:
+        paddle2onnx_version = None
+    model_hash = hashlib.sha256("\n".join([
+        paddle_model_hash(paddle_model_dir),
+        json.dumps(ONNX_SETTINGS, sort_keys=True),
+        json.dumps(INPUT_SHAPES[model_type]),
+        str(paddle2onnx_version)
+    ]).encode('utf-8')).hexdigest()
+    # The sidecar lives in the download cache so it is never deployed with the models
+    output_key = hashlib.sha256(os.path.abspath(onnx_output_path).encode('utf-8')).hexdigest()[:16]
+    hash_path = os.path.join(paddle_model_dir, f"{os.path.basename(onnx_output_path)}.{output_key}.hash")
+    if os.path.exists(onnx_output_path) and os.path.exists(hash_path):
+        with open(hash_path) as f:
+            if f.read().strip() == model_hash:
+                print(f"Using cached {onnx_output_path}")
+                if model_type == "rec":
+                    export_width_buckets(onnx_output_path, overwrite=False)
+                return onnx_output_path
     
-    # Prepare conversion command
-    cmd = [
-        "paddle2onnx",
-        "--model_dir", paddle_model_dir,
-        "--model_filename", "inference.pdmodel",
-        "--params_filename", "inference.pdiparams",
-        "--save_file", onnx_output_path,
-        "--opset_version", str(ONNX_SETTINGS["opset_version"]),
-        "--deploy_backend", ONNX_SETTINGS["deploy_backend"]
-    ]
+    print(f"Converting {model_type} model to ONNX...")
     
-    if ONNX_SETTINGS["enable_onnx_checker"]:
-        cmd.append("--enable_onnx_checker")
+    # Only the paddle2onnx 1.x export() API is supported. Its first two parameters are
+    # model_file/params_file in 1.0-1.1 and model_filename/params_filename from 1.2 on,
+    # so the model paths are passed positionally
+    try:
+        import paddle2onnx
+    except ImportError:
+        raise RuntimeError("paddle2onnx not available. Install with: pip install 'paddle2onnx<2'")
+    if not paddle2onnx.__version__.startswith("1."):
+        raise RuntimeError(
+            f"paddle2onnx {paddle2onnx.__version__} is not supported, this script targets the 1.x "
+            "export() API. Install with: pip install 'paddle2onnx<2'"
+        )
     
-    if ONNX_SETTINGS["enable_auto_update_opset"]:
-        cmd.append("--enable_auto_update_opset")
+    opset_versions = [ONNX_SETTINGS["opset_version"], ONNX_SETTINGS["fallback_opset_version"]]
     
-    # Add input/output specs for better optimization
-    if model_type == "det":
-        cmd.extend([
-            "--input_shape_dict", '{"x": [-1, 3, -1, -1]}',
-        ])
-    else:  # rec
-        cmd.extend([
-            "--input_shape_dict", '{"x": [-1, 3, 48, -1]}',
-        ])
+    # Export in-process so the paddle/paddle2onnx import is paid once per worker.
+    # A failed conversion returns empty bytes instead of raising, so only write on success
+    for opset_version in opset_versions:
+        try:
+            onnx_bytes = paddle2onnx.export(
+                os.path.join(paddle_model_dir, "inference.pdmodel"),
+                os.path.join(paddle_model_dir, "inference.pdiparams"),
+                save_file=None,
+                opset_version=opset_version,
+                auto_upgrade_opset=ONNX_SETTINGS["enable_auto_update_opset"],
+                enable_onnx_checker=ONNX_SETTINGS["enable_onnx_checker"],
+                enable_optimize=ONNX_SETTINGS["enable_optimize"],
+                deploy_backend=ONNX_SETTINGS["deploy_backend"]
+            )
+        except Exception as e:
+            onnx_bytes = None
+            error = e
+        else:
+            error = "paddle2onnx returned an empty model"
+        
+        if onnx_bytes:
+            with open(onnx_output_path, 'wb') as f:
+                f.write(onnx_bytes)
+            break
+        
+        print(f"Error converting model at opset {opset_version}: {error}")
+    else:
+        raise RuntimeError(f"Model conversion failed: {error}")
     
-    # Run conversion
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    # Add input specs for better optimization
+    set_input_shape(onnx_output_path, INPUT_SHAPES[model_type])
     
-    if result.returncode != 0:
-        print(f"Error converting model: {result.stderr}")
-        raise RuntimeError(f"Model conversion failed: {result.stderr}")
+    with open(hash_path, 'w') as f:
+        f.write(model_hash)
     
     print(f"Successfully converted to {onnx_output_path}")
+    
+    if model_type == "rec":
+        export_width_buckets(onnx_output_path)
+    
     return onnx_output_path
 
-def optimize_onnx_for_web(onnx_path, optimized_path):
+@contextlib.contextmanager
+def scratch_working_dir():
+    """Run inside a throwaway working directory (each pool worker is its own process)"""
+    previous_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        os.chdir(scratch_dir)
+        try:
+            yield scratch_dir
+        finally:
+            os.chdir(previous_dir)
+
+def uses_external_data(onnx_path):
+    """Check whether a model is too large for a single protobuf or already references external data"""
+    import onnx
+    
+    if os.path.getsize(onnx_path) > EXTERNAL_DATA_THRESHOLD:
+        return True
+    model = onnx.load(onnx_path, load_external_data=False)
+    return any(init.data_location == onnx.TensorProto.EXTERNAL for init in model.graph.initializer)
+
+def has_3d_matmul_weights(model):
+    """Check for MatMul nodes with 3D weights (per-channel breaks MatMulIntegerToFloat)"""
+    initializer_ranks = {init.name: len(init.dims) for init in model.graph.initializer}
+    return any(
+        node.op_type == 'MatMul' and any(initializer_ranks.get(name) == 3 for name in node.input)
+        for node in model.graph.node
+    )
+
+def sensitive_node_names(model, model_type="det"):
+    """Return the stem Conv and output head node names, the most quantization-sensitive layers"""
+    nodes = list(model.graph.node)
+    # DBNet ends in Conv -> ConvTranspose with no MatMul/Gemm, CRNN ends in a MatMul/Gemm
+    head_op_types = ('Conv',) if model_type == "det" else ('MatMul', 'Gemm')
+    
+    first_conv = next((node for node in nodes if node.op_type == 'Conv'), None)
+    last_head = next((node for node in reversed(nodes) if node.op_type in head_op_types), None)
+    
+    names = []
+    for label, node in (("stem Conv", first_conv), ("output head", last_head)):
+        if node is None:
+            print(f"Warning: no {label} found, it will be quantized")
+        elif not node.name:
+            print(f"Warning: {label} ({node.op_type}) is unnamed and cannot be excluded from quantization")
+        else:
+            names.append(node.name)
+    return names
+
+def optimize_onnx_for_web(onnx_path, optimized_path, model_type="det", calibration_dir=None, target="cpu"):
     """Further optimize ONNX model for web deployment"""
     print(f"Optimizing ONNX model for web deployment...")
     
     try:
         import onnx
-        from onnxruntime.transformers import optimizer
-        from onnxruntime.quantization import quantize_dynamic, QuantType
-        
-        # Load model
-        model = onnx.load(onnx_path)
-        
-        # Run ONNX Runtime optimizations
-        optimized_model = optimizer.optimize_model(
-            onnx_path,
-            model_type='bert',  # Use bert optimization passes
-            num_heads=0,  # Will be auto-detected
-            hidden_size=0,  # Will be auto-detected
-            optimization_options=optimizer.FusionOptions('all')
-        )
+        import onnxruntime as ort
+        from onnxruntime.quantization import quantize_dynamic, quantize_static, QuantFormat, QuantType
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+    except ImportError:
+        print("Warning: onnxruntime optimization tools not available")
+        print("Install with: pip install onnx onnxruntime")
+        # Just copy the file if optimization tools aren't available
+        shutil.copy2(onnx_path, optimized_path)
+        # Drop a quantized model left by an earlier run so it is not listed as current
+        stale_quantized_path = optimized_path.replace('.onnx', '_quantized.onnx')
+        if os.path.exists(stale_quantized_path):
+            os.remove(stale_quantized_path)
+        return
+    
+    # Models near the 2GB protobuf limit must keep their weights as external data
+    use_external_data = uses_external_data(onnx_path)
+    
+    # Normalize shapes and fold constants so quantization sees every Conv/MatMul.
+    # quant_pre_process drops temp models (and their external data) into the CWD
+    # when symbolic shape inference fails, so run it in a private scratch directory
+    onnx_path = os.path.abspath(onnx_path)
+    preprocessed_path = os.path.abspath(optimized_path.replace('.onnx', '_preprocessed.onnx'))
+    preprocessed_data_path = preprocessed_path + '.data'
+    pre_process_options = {
+        "skip_optimization": False,
+        "skip_onnx_shape": False,
+        "save_as_external_data": use_external_data,
+        # Keep external weights in one file that can be removed with the model
+        "all_tensors_to_one_file": True,
+        "external_data_location": os.path.basename(preprocessed_data_path),
+    }
+    with scratch_working_dir():
+        try:
+            quant_pre_process(onnx_path, preprocessed_path, skip_symbolic_shape=False, **pre_process_options)
+        except Exception as e:
+            # DB detection heads defeat symbolic shape inference, plain ONNX inference is enough
+            print(f"Warning: symbolic shape inference failed ({e}), retrying without it")
+            quant_pre_process(onnx_path, preprocessed_path, skip_symbolic_shape=True, **pre_process_options)
+    
+    try:
+        # Run ONNX Runtime graph optimizations offline (Conv+BN, Conv+Add,
+        # Conv+Mul, Relu/Clip fusions) and serialize the optimized graph so wasm
+        # clients can skip graph optimization at load time. EXTENDED avoids the
+        # AVX2-specific NCHWc layouts of ALL, but still emits com.microsoft CPU
+        # contrib ops (FusedConv, FusedMatMul, ...), so the result is for the
+        # wasm/CPU execution provider only
+        # The onnxruntime.transformers presets (bert/unet/vit) are deliberately not
+        # used: their fusions target attention/GroupNorm blocks, not DB or CRNN heads
+        sess_options = ort.SessionOptions()
+        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+        sess_options.optimized_model_filepath = optimized_path
+        if use_external_data:
+            sess_options.add_session_config_entry(
+                'session.optimized_model_external_initializers_file_name',
+                os.path.basename(optimized_path) + '.data'
+            )
+        ort.InferenceSession(preprocessed_path, sess_options, providers=['CPUExecutionProvider'])
         
-        # Save optimized model
-        optimized_model.save_model_to_file(optimized_path)
+        # Create FP16 version for WebGPU and mobile GPU backends (halves weight bytes).
+        # It is built from the portable preprocessed graph, not the CPU-optimized one,
+        # which may hold CPU-only fused ops, so it is named after the exported model
+        fp16_path = onnx_path.replace('.onnx', '_fp16.onnx')
+        try:
+            from onnxconverter_common import float16
+        except ImportError:
+            float16 = None
+            print("Warning: onnxconverter-common not available, skipping FP16 conversion")
+            print("Install with: pip install onnxconverter-common")
+            # Drop an FP16 model left by an earlier run so it is not listed as current
+            for path in (fp16_path, fp16_path + '.data'):
+                if os.path.exists(path):
+                    os.remove(path)
+        
+        if float16 is not None:
+            model_fp16 = float16.convert_float_to_float16(
+                onnx.load(preprocessed_path),
+                keep_io_types=True,
+                op_block_list=float16.DEFAULT_OP_BLOCK_LIST + ['GridSample']
+            )
+            onnx.save(
+                model_fp16,
+                fp16_path,
+                save_as_external_data=use_external_data,
+                location=os.path.basename(fp16_path) + '.data'
+            )
+            print(f"FP16 version: {fp16_path}")
         
-        # Optionally create quantized version for smaller size
+        # Create INT8 version for smaller size and faster CPU inference
         quantized_path = optimized_path.replace('.onnx', '_quantized.onnx')
-        quantize_dynamic(
-            optimized_path,
-            quantized_path,
-            weight_type=QuantType.QUInt8
-        )
+        model = onnx.load(preprocessed_path, load_external_data=False)
         
-        print(f"Optimization complete: {optimized_path}")
-        print(f"Quantized version: {quantized_path}")
+        # Keep the stem conv and the output head in FP32 to preserve small-character accuracy
+        op_types_to_quantize = ['Conv', 'MatMul']
+        nodes_to_exclude = sensitive_node_names(model, model_type)
         
-        # Compare file sizes
-        original_size = os.path.getsize(onnx_path) / (1024 * 1024)
-        optimized_size = os.path.getsize(optimized_path) / (1024 * 1024)
-        quantized_size = os.path.getsize(quantized_path) / (1024 * 1024)
+        if calibration_dir:
+            # Static quantization turns Conv into QLinearConv using calibrated activation scales
+            initializer_names = {init.name for init in model.graph.initializer}
+            model_input = next(i for i in model.graph.input if i.name not in initializer_names)
+            # Fixed-width rec buckets must be calibrated at their own width
+            rec_width = None
+            if model_type == "rec":
+                width_dim = model_input.type.tensor_type.shape.dim[3]
+                rec_width = width_dim.dim_value if width_dim.HasField('dim_value') else None
+            per_channel = not has_3d_matmul_weights(model)
+            if not per_channel:
+                print("Warning: 3D MatMul weights found, using per-tensor quantization")
         
-        print(f"Size comparison:")
-        print(f"  Original: {original_size:.2f} MB")
-        print(f"  Optimized: {optimized_size:.2f} MB ({(1 - optimized_size/original_size)*100:.1f}% reduction)")
-        print(f"  Quantized: {quantized_size:.2f} MB ({(1 - quantized_size/original_size)*100:.1f}% reduction)")
+            # QOperator fuses (de)quantization into QLinearConv MLAS kernels on CPU,
+            # QDQ is kept only for portability to other backends
+            quant_format = QuantFormat.QOperator if target == "cpu" else QuantFormat.QDQ
         
-    except ImportError:
-        print("Warning: onnxruntime optimization tools not available")
-        print("Install with: pip install onnxruntime-tools")
-        # Just copy the file if optimization tools aren't available
-        import shutil
-        shutil.copy2(onnx_path, optimized_path)
+            data_reader = PaddleOCRCalibrationDataReader(
+                calibration_dir, model_input.name, model_type, rec_width
+            )
+            quantize_static(
+                preprocessed_path,
+                quantized_path,
+                data_reader,
+                quant_format=quant_format,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                per_channel=per_channel,
+                reduce_range=False,
+                op_types_to_quantize=op_types_to_quantize,
+                nodes_to_exclude=nodes_to_exclude,
+                use_external_data_format=use_external_data,
+                # Symmetric per-channel weights run on the same QLinearConv kernel at no extra cost
+                extra_options={'WeightSymmetric': True, 'ActivationSymmetric': False}
+            )
+        else:
+            print("Warning: no calibration images given, falling back to dynamic quantization")
+            quantize_dynamic(
+                preprocessed_path,
+                quantized_path,
+                weight_type=QuantType.QUInt8,
+                op_types_to_quantize=op_types_to_quantize,
+                nodes_to_exclude=nodes_to_exclude,
+                use_external_data_format=use_external_data
+            )
+    finally:
+        for path in (preprocessed_path, preprocessed_data_path):
+            if os.path.exists(path):
+                os.remove(path)
+    
+    # Quantization can pin dynamic dims, keep one session usable for all image sizes
+    restore_dynamic_axes(onnx_path, quantized_path)
+    
+    print(f"Optimization complete: {optimized_path}")
+    print(f"Quantized version: {quantized_path}")
+    
+    # Compare file sizes
+    original_size = os.path.getsize(onnx_path) / (1024 * 1024)
+    optimized_size = os.path.getsize(optimized_path) / (1024 * 1024)
+    quantized_size = os.path.getsize(quantized_path) / (1024 * 1024)
+    
+    print(f"Size comparison:")
+    print(f"  Original: {original_size:.2f} MB")
+    print(f"  Optimized: {optimized_size:.2f} MB ({(1 - optimized_size/original_size)*100:.1f}% reduction)")
+    print(f"  Quantized: {quantized_size:.2f} MB ({(1 - quantized_size/original_size)*100:.1f}% reduction)")
+    if os.path.exists(fp16_path):
+        fp16_size = os.path.getsize(fp16_path) / (1024 * 1024)
+        print(f"  FP16: {fp16_size:.2f} MB ({(1 - fp16_size/original_size)*100:.1f}% reduction)")
+
+def resolve_model_spec(model_spec):
+    """Map a model spec like det_mobile to (model_type, variant, url, model_name)"""
+    model_type, _, variant = model_spec.partition('_')
+    
+    if model_type == "det":
+        url = MODEL_URLS["det"].get(variant)
+        model_name = f"PP-OCRv5_{variant}_det"
+    elif model_type == "rec":
+        url = MODEL_URLS["rec"].get(f"{variant}")
+        model_name = f"PP-OCRv5_{variant}_rec"
+    else:
+        print(f"Unknown model type: {model_type}")
+        return None
+    
+    if not url:
+        print(f"Unknown model variant: {model_spec}")
+        return None
+    
+    return model_type, variant, url, model_name
 
 def create_model_metadata(models_info, output_path):
     """Create metadata file for converted models"""
@@ -158,92 +584,174 @@ def create_model_metadata(models_info, output_path):
             "recognition": {
                 "input_shape": "[-1, 3, 48, -1]",
                 "notes": "Fixed height of 48, dynamic width"
+            },
+            "runtime": {
+                "graph_optimization": "extended",
+                "notes": "optimized_onnx is pre-fused for the wasm/CPU execution provider and contains "
+                         "com.microsoft CPU ops; load it with executionProviders ['wasm'] and "
+                         "graphOptimizationLevel 'disabled'. For webgl/webgpu use original_onnx or fp16_onnx "
+                         "with graph optimization enabled"
             }
         }
     }
     
-    with open(output_path, 'w') as f:
-        json.dump(metadata, f, indent=2)
+    if any("width_buckets" in info for info in models_info.values()):
+        metadata["optimization_notes"]["recognition"].update({
+            "width_buckets": REC_WIDTH_BUCKETS,
+            "width_bucket_notes": "Fixed [1, 3, 48, W] variants, pad crops to the nearest bucket"
+        })
+    
+    # Compact JSON for clients, pretty-printed copy for humans
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, separators=(',', ':'))
     
-    print(f"Model metadata saved to {output_path}")
+    debug_path = Path(output_path).with_suffix('.debug.json')
+    with open(debug_path, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    
+    print(f"Model metadata saved to {output_path} (readable copy: {debug_path})")
+
+def optimize_model_files(onnx_path, model_type, calibration_dir=None, target="cpu"):
+    """Optimize one exported model and return the file names of its variants"""
+    optimized_path = onnx_path.with_name(onnx_path.name.replace('.onnx', '_optimized.onnx'))
+    optimize_onnx_for_web(str(onnx_path), str(optimized_path), model_type, calibration_dir, target)
+    
+    files = {
+        "original_onnx": str(onnx_path.name),
+        "optimized_onnx": str(optimized_path.name)
+    }
+    
+    quantized_path = optimized_path.with_name(optimized_path.name.replace('.onnx', '_quantized.onnx'))
+    if quantized_path.exists():
+        files["quantized_onnx"] = str(quantized_path.name)
+    
+    fp16_path = onnx_path.with_name(onnx_path.name.replace('.onnx', '_fp16.onnx'))
+    if fp16_path.exists():
+        files["fp16_onnx"] = str(fp16_path.name)
+    
+    return files
+
+def process_one(model_spec, output_dir, cache_dir, skip_opt, calibration_dir=None, target="cpu",
+                skip_download=False):
+    """Download, convert and optimize a single model, returning (model_name, info)"""
+    resolved = resolve_model_spec(model_spec)
+    if not resolved:
+        return model_spec, None
+    model_type, variant, url, model_name = resolved
+    
+    try:
+        print(f"\nProcessing {model_name}...")
+        
+        # Download and extract
+        paddle_model_dir = download_model(url, str(cache_dir), skip_download)
+        
+        # Convert to ONNX
+        onnx_path = output_dir / f"{model_name}.onnx"
+        convert_to_onnx(paddle_model_dir, str(onnx_path), model_type)
+        
+        info = {
+            "type": model_type,
+            "variant": variant
+        }
+        
+        # Optimize for web
+        if skip_opt:
+            info["onnx"] = str(onnx_path.name)
+        else:
+            info.update(optimize_model_files(onnx_path, model_type, calibration_dir, target))
+        
+        # Fixed-width rec variants go through the same optimize/quantize path
+        if model_type == "rec":
+            info["width_buckets"] = {}
+            for width in REC_WIDTH_BUCKETS:
+                bucket_path = Path(width_bucket_path(str(onnx_path), width))
+                if skip_opt:
+                    bucket_info = {"onnx": str(bucket_path.name)}
+                else:
+                    bucket_info = optimize_model_files(bucket_path, model_type, calibration_dir, target)
+                info["width_buckets"][str(width)] = bucket_info
+        
+        return model_name, info
+        
+    except Exception as e:
+        print(f"Error processing {model_name}: {e}")
+        return model_name, None
+
+def init_worker(settings):
+    """Apply CLI-adjusted conversion settings inside pool workers"""
+    ONNX_SETTINGS.update(settings)
 
 def main():
     parser = argparse.ArgumentParser(description="Convert PaddleOCR models to optimized ONNX")
     parser.add_argument("--output-dir", default="./onnx_models", help="Output directory for ONNX models")
     parser.add_argument("--models", nargs="+", default=["det_mobile", "rec_mobile_en"], 
                         help="Models to convert (det_mobile, det_server, rec_mobile_en, rec_mobile_ch)")
-    parser.add_argument("--skip-download", action="store_true", help="Skip downloading if models exist")
+    parser.add_argument("--skip-download", action="store_true",
+                        help="Skip downloading if models exist in the cache, without verifying them")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help="Directory for cached Paddle model downloads (kept between runs)")
     parser.add_argument("--skip-optimization", action="store_true", help="Skip ONNX optimization step")
+    parser.add_argument("--calibration-dir", help="Directory of sample images for static INT8 quantization")
+    parser.add_argument("--target", choices=["cpu", "webgpu"], default="cpu",
+                        help="Deployment target (cpu: QOperator INT8, webgpu: portable QDQ INT8)")
+    parser.add_argument("--strict-check", action="store_true",
+                        help="Run the ONNX checker during export (slow on server models)")
     
     args = parser.parse_args()
     
+    if args.calibration_dir and not args.skip_optimization:
+        try:
+            check_calibration_dependencies()
+        except RuntimeError as e:
+            parser.error(str(e))
+    
+    # The dynamic quantization fallback only has one (QOperator-style) format
+    if args.target != "cpu" and not args.calibration_dir and not args.skip_optimization:
+        parser.error(f"--target {args.target} requires --calibration-dir (static QDQ quantization)")
+    
+    ONNX_SETTINGS["enable_onnx_checker"] = args.strict_check
+    
     # Create directories
     output_dir = Path(args.output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
-    temp_dir = output_dir / "temp"
-    temp_dir.mkdir(exist_ok=True)
+    # Downloaded Paddle models are kept between runs, outside the deployed output directory
+    cache_dir = Path(args.cache_dir).expanduser()
+    cache_dir.mkdir(parents=True, exist_ok=True)
     
     models_info = {}
     
-    for model_spec in args.models:
-        try:
-            model_type, variant = model_spec.split('_', 1)
-            
-            if model_type == "det":
-                url = MODEL_URLS["det"].get(variant)
-                model_name = f"PP-OCRv5_{variant}_det"
-            elif model_type == "rec":
-                url = MODEL_URLS["rec"].get(f"{variant}")
-                model_name = f"PP-OCRv5_{variant}_rec"
-            else:
-                print(f"Unknown model type: {model_type}")
-                continue
-            
-            if not url:
-                print(f"Unknown model variant: {model_spec}")
-                continue
-            
-            print(f"\nProcessing {model_name}...")
-            
-            # Download and extract
-            paddle_model_dir = download_model(url, str(temp_dir))
-            
-            # Convert to ONNX
-            onnx_path = output_dir / f"{model_name}.onnx"
-            convert_to_onnx(paddle_model_dir, str(onnx_path), model_type)
-            
-            # Optimize for web
-            if not args.skip_optimization:
-                optimized_path = output_dir / f"{model_name}_optimized.onnx"
-                optimize_onnx_for_web(str(onnx_path), str(optimized_path))
-                
-                models_info[model_name] = {
-                    "type": model_type,
-                    "variant": variant,
-                    "original_onnx": str(onnx_path.name),
-                    "optimized_onnx": str(optimized_path.name),
-                    "quantized_onnx": str(optimized_path.name.replace('.onnx', '_quantized.onnx'))
-                }
-            else:
-                models_info[model_name] = {
-                    "type": model_type,
-                    "variant": variant,
-                    "onnx": str(onnx_path.name)
-                }
-            
-        except Exception as e:
-            print(f"Error processing {model_spec}: {e}")
-            continue
+    # Models are independent, so overlap downloads, conversion and quantization across processes
+    model_specs = list(dict.fromkeys(args.models))
+    worker = partial(
+        process_one,
+        output_dir=output_dir,
+        cache_dir=cache_dir,
+        skip_opt=args.skip_optimization,
+        calibration_dir=args.calibration_dir,
+        target=args.target,
+        skip_download=args.skip_download
+    )
+    with ProcessPoolExecutor(
+        max_workers=min(len(model_specs), os.cpu_count() or 1),
+        initializer=init_worker,
+        initargs=(dict(ONNX_SETTINGS),)
+    ) as executor:
+        for model_name, info in executor.map(worker, model_specs):
+            if info:
+                models_info[model_name] = info
     
     # Create metadata
     create_model_metadata(models_info, output_dir / "models_metadata.json")
     
     print("\nConversion complete!")
     print(f"Models saved to: {output_dir}")
+    print(f"Downloaded Paddle models cached in: {cache_dir}")
     
-    # Cleanup
-    print("\nCleaning up temporary files...")
-    subprocess.run(["rm", "-rf", str(temp_dir)], check=True)
+    # Remove the temp download directory used by earlier versions of this script
+    legacy_temp_dir = output_dir / "temp"
+    if legacy_temp_dir.exists():
+        print("\nCleaning up temporary files...")
+        shutil.rmtree(legacy_temp_dir, ignore_errors=True)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file